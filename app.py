@@ -1,79 +1,106 @@
-from fastapi import FastAPI, Request, Form, HTTPException
+from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
-from typing import List, Optional
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
+from jinja2 import FileSystemBytecodeCache
+from logging.handlers import QueueHandler, QueueListener
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from prometheus_fastapi_instrumentator import Instrumentator
 import uvicorn
 import logging
+import queue
 import requests
 import os
 
-from perplexity_service import PerplexityService
+from forms import RecommendForm, recommend_form
+from perplexity_service import PerplexityService, create_perplexity_client
 
 load_dotenv()
 
-# Logging configuration
-logging.basicConfig(level=logging.INFO)
+# Logging configuration: records are queued and written to stderr by a listener thread,
+# so request handlers never block on the stream
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+# The queue handler must not format: QueueHandler.prepare() would bake the prefix into the
+# message, and the stream handler below would then add it a second time
+root_logger = logging.getLogger()
+root_logger.handlers = [QueueHandler(log_queue)]
+root_logger.setLevel(logging.INFO)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
-app = FastAPI(title="Medication Recommender")
+app = FastAPI(title="Medication Recommender", default_response_class=ORJSONResponse)
+
+# Request latency and count metrics, exposed on /metrics below
+Instrumentator().instrument(app)
 
 # Set up static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# Templates never change at runtime: skip per-request stat checks and reuse compiled bytecode
+templates = Jinja2Templates(
+    directory="templates",
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache(),
+    cache_size=400
+)
+
+# Pages with no per-request content, rendered once per worker at startup
+static_pages: Dict[str, bytes] = {}
+STATIC_PAGE_HEADERS = {"Cache-Control": "public, max-age=60"}
 
 # Initialize Perplexity service
 perplexity_service = PerplexityService()
 
+@app.on_event("startup")
+async def startup_event():
+    """Start log forwarding, open shared upstream connections and pre-render templates for this worker"""
+    log_listener.start()
+    for template_name in ("landing.html", "index.html"):
+        static_pages[template_name] = templates.get_template(template_name).render().encode("utf-8")
+    templates.get_template("results.html")
+    app.state.perplexity_client = create_perplexity_client()
+    await perplexity_service.startup(app.state.perplexity_client)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared upstream connections and flush queued logs"""
+    await perplexity_service.shutdown()
+    await app.state.perplexity_client.aclose()
+    log_listener.stop()
+
 @app.get("/", response_class=HTMLResponse)
-async def get_landing(request: Request):
-    """Render the landing page"""
-    return templates.TemplateResponse(
-        "landing.html", 
-        {"request": request}
-    )
+async def get_landing():
+    """Serve the pre-rendered landing page"""
+    return HTMLResponse(static_pages["landing.html"], headers=STATIC_PAGE_HEADERS)
 
 @app.get("/form", response_class=HTMLResponse)
-async def get_form(request: Request):
-    """Render the form page"""
-    return templates.TemplateResponse(
-        "index.html", 
-        {"request": request}
-    )
+async def get_form():
+    """Serve the pre-rendered form page"""
+    return HTMLResponse(static_pages["index.html"], headers=STATIC_PAGE_HEADERS)
 
 @app.post("/recommend", response_class=HTMLResponse)
 async def recommend_medication(
     request: Request,
-    symptoms: str = Form(...),
-    gender: str = Form(None),  # Make optional
-    age: str = Form(None),     # Make optional
-    allergic: str = Form(None)  # Make optional
+    form: RecommendForm = Depends(recommend_form)
 ):
-    gender = gender or "not specified"
-    age = age or "not specified"
-    allergic = allergic or "none"
     """Process medication recommendation request"""
     try:
-        # Split and clean symptoms
-        symptom_list = [s.strip() for s in symptoms.split(',') if s.strip()]
-        
-        if not symptom_list:
-            return templates.TemplateResponse(
-                "index.html", 
-                {
-                    "request": request,
-                    "error": "Please enter at least one symptom."
-                }
-            )
-        
+        # Identical submissions are answered with the page rendered for an earlier one
+        page_key = perplexity_service.page_cache_key(form.symptoms, form.gender, form.age, form.allergic)
+        cached_page = await perplexity_service.get_cached_page(page_key)
+        if cached_page is not None:
+            return HTMLResponse(cached_page)
+
         # Get medication recommendations via Perplexity API
-        medications = perplexity_service.get_medication_recommendations(
-            symptom_list, 
-            gender, 
-            age, 
-            allergic
+        medications = await perplexity_service.get_medication_recommendations(
+            form.symptoms, 
+            form.gender, 
+            form.age, 
+            form.allergic
         )
         
         if not medications:
@@ -85,21 +112,19 @@ async def recommend_medication(
                 }
             )
         
-        # Render results page
-        return templates.TemplateResponse(
-            "results.html", 
-            {
-                "request": request,
-                "medications": medications,
-                "symptoms": symptoms,
-                "gender": gender,
-                "age": age,
-                "allergic": allergic
-            }
-        )
+        # Render the results page here so rendering errors still reach the error template below
+        page = templates.get_template("results.html").render(
+            medications=medications,
+            symptoms=", ".join(form.symptoms),
+            gender=form.gender,
+            age=form.age,
+            allergic=form.allergic
+        ).encode("utf-8")
+        await perplexity_service.cache_page(page_key, page)
+        return HTMLResponse(page)
         
     except Exception as e:
-        logger.error(f"Error in medication recommendation: {e}")
+        logger.error("Error in medication recommendation: %s", e)
         return templates.TemplateResponse(
             "index.html", 
             {
@@ -116,20 +141,20 @@ async def get_nearby_pharmacies(zipcode: str):
         
         if not api_key:
             logger.error("Google Places API key not found in environment variables")
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={"error": "API key not configured. Please contact the administrator."}
             )
         
-        logger.info(f"Searching pharmacies for zipcode: {zipcode}")
+        logger.info("Searching pharmacies for zipcode: %s", zipcode)
         
         # Google Geocoding API call to convert zipcode to coordinates
         geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={zipcode}&key={api_key}"
         geocode_response = requests.get(geocode_url, timeout=10)
         
         if geocode_response.status_code != 200:
-            logger.error(f"Geocode API HTTP error: {geocode_response.status_code}")
-            return JSONResponse(
+            logger.error("Geocode API HTTP error: %s", geocode_response.status_code)
+            return ORJSONResponse(
                 status_code=geocode_response.status_code,
                 content={"error": f"Error connecting to geocoding service: {geocode_response.status_code}"}
             )
@@ -137,15 +162,15 @@ async def get_nearby_pharmacies(zipcode: str):
         geocode_data = geocode_response.json()
         
         if geocode_data["status"] != "OK":
-            logger.error(f"Geocode API error: {geocode_data.get('status')}")
-            return JSONResponse(
+            logger.error("Geocode API error: %s", geocode_data.get('status'))
+            return ORJSONResponse(
                 status_code=400,
                 content={"error": f"Geocoding service error: {geocode_data.get('status')}"}
             )
         
         if not geocode_data["results"]:
             logger.error("Geocode API returned no results")
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=404,
                 content={"error": "Location not found for this ZIP code"}
             )
@@ -153,15 +178,15 @@ async def get_nearby_pharmacies(zipcode: str):
         # Extract location data
         location = geocode_data["results"][0]["geometry"]["location"]
         lat, lng = location["lat"], location["lng"]
-        logger.info(f"Location found - latitude: {lat}, longitude: {lng}")
+        logger.info("Location found - latitude: %s, longitude: %s", lat, lng)
         
         # Google Places API call to find nearby pharmacies
         places_url = f"https://maps.googleapis.com/maps/api/place/nearbysearch/json?location={lat},{lng}&radius=5000&type=pharmacy&key={api_key}"
         places_response = requests.get(places_url, timeout=10)
         
         if places_response.status_code != 200:
-            logger.error(f"Places API HTTP error: {places_response.status_code}")
-            return JSONResponse(
+            logger.error("Places API HTTP error: %s", places_response.status_code)
+            return ORJSONResponse(
                 status_code=places_response.status_code,
                 content={"error": f"Error connecting to places service: {places_response.status_code}"}
             )
@@ -169,15 +194,15 @@ async def get_nearby_pharmacies(zipcode: str):
         places_data = places_response.json()
         
         if places_data["status"] != "OK":
-            logger.error(f"Places API error: {places_data.get('status')}")
-            return JSONResponse(
+            logger.error("Places API error: %s", places_data.get('status'))
+            return ORJSONResponse(
                 status_code=400,
                 content={"error": f"Places service error: {places_data.get('status')}"}
             )
         
         if not places_data["results"]:
             logger.warning("No pharmacies found near this location")
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=404,
                 content={"error": "No pharmacies found near this location"}
             )
@@ -192,24 +217,24 @@ async def get_nearby_pharmacies(zipcode: str):
             }
             pharmacies.append(pharmacy)
         
-        logger.info(f"Found {len(pharmacies)} pharmacies near {zipcode}")
-        return JSONResponse(content={"pharmacies": pharmacies})
+        logger.info("Found %s pharmacies near %s", len(pharmacies), zipcode)
+        return ORJSONResponse(content={"pharmacies": pharmacies})
         
     except requests.exceptions.Timeout:
         logger.error("Request to Google API timed out")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=504,
             content={"error": "Request to Google API timed out"}
         )
     except requests.exceptions.RequestException as e:
-        logger.error(f"Request error: {str(e)}")
-        return JSONResponse(
+        logger.error("Request error: %s", e)
+        return ORJSONResponse(
             status_code=500,
             content={"error": "Error connecting to Google API"}
         )
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        return JSONResponse(
+        logger.error("Unexpected error: %s", e)
+        return ORJSONResponse(
             status_code=500,
             content={"error": "An unexpected error occurred"}
         )
@@ -219,6 +244,20 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
-# Server startup code
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics, aggregated across all Gunicorn workers in multiprocess mode"""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+# Local development server; production runs under Gunicorn (see gunicorn_conf.py)
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=os.getenv("RELOAD", "false").lower() == "true"
+    )
\ No newline at end of file
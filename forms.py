@@ -0,0 +1,35 @@
+from fastapi import Form
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError, conlist, validator
+from typing import Optional
+
+class RecommendForm(BaseModel):
+    """Validated fields of the medication recommendation form."""
+    symptoms: conlist(str, min_items=1)
+    gender: str = "not specified"
+    age: str = "not specified"
+    allergic: str = "none"
+
+    @validator("symptoms", pre=True)
+    def split_symptoms(cls, value):
+        """Accept the comma-separated form value and drop empty entries."""
+        if isinstance(value, str):
+            return [p for p in (s.strip() for s in value.split(",")) if p]
+        return value
+
+    @validator("gender", "age", "allergic", pre=True)
+    def default_when_blank(cls, value, field):
+        """Optional fields left blank fall back to their defaults."""
+        return value or field.default
+
+async def recommend_form(
+    symptoms: str = Form(...),
+    gender: Optional[str] = Form(None),
+    age: Optional[str] = Form(None),
+    allergic: Optional[str] = Form(None)
+) -> RecommendForm:
+    """Dependency that builds a RecommendForm from posted form fields, answering 422 on invalid input."""
+    try:
+        return RecommendForm(symptoms=symptoms, gender=gender, age=age, allergic=allergic)
+    except ValidationError as e:
+        raise RequestValidationError(e.raw_errors)
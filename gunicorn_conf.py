@@ -0,0 +1,28 @@
+import os
+import shutil
+
+# Gunicorn configuration for production:
+#   gunicorn app:app -c gunicorn_conf.py
+# uvicorn[standard] installs uvloop and httptools, which UvicornWorker picks up automatically.
+
+# Workers write metrics to files in this directory and /metrics aggregates them. It must be
+# set before prometheus_client is first imported, so this module doesn't import it at the top.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/dev/shm/prometheus")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Heartbeat files on tmpfs so a slow disk can't stall workers
+worker_tmp_dir = "/dev/shm"
+keepalive = 5
+
+def on_starting(server):
+    """Start each run with an empty metrics directory."""
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+def child_exit(server, worker):
+    """Drop the live metric files of a worker that exited."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,30 +1,304 @@
 import os
-import requests
-import json
+import asyncio
+import cachetools
+import httpx
+import hashlib
+import orjson
 import re
+from functools import partial
+from urllib.parse import quote
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
+from prometheus_client import Counter, Histogram
+from redis import asyncio as aioredis
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from typing import List, Dict, Any, AsyncIterator, Optional
 import logging
 
 # Load environment variables
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+PERPLEXITY_API_URL = "https://api.perplexity.ai"
+
+# Metrics exported on /metrics
+PERPLEXITY_SECONDS = Histogram(
+    "perplexity_seconds",
+    "Time spent on Perplexity queries, including retries",
+    buckets=(.1, .25, .5, 1, 2, 5, 10, 30)
+)
+PARSE_SECONDS = Histogram("medication_parse_seconds", "Time spent parsing Perplexity responses")
+CACHE_HITS = Counter("cache_hits_total", "Recommendation cache hits", labelnames=["tier"])
+CACHE_MISSES = Counter("cache_misses_total", "Recommendation cache misses")
+PAGE_CACHE_HITS = Counter("page_cache_hits_total", "Rendered results page cache hits", labelnames=["tier"])
+PAGE_CACHE_MISSES = Counter("page_cache_misses_total", "Rendered results page cache misses")
+
+# Recommendation prompt; the response schema itself is enforced via MEDICATION_RESPONSE_FORMAT
+_PROMPT = (
+    "I'm {gender} and {age} years old. "
+    "I'm allergic to {allergic}. "
+    "I have the following symptoms: {symptoms}. "
+    "Recommend exactly 3 over-the-counter medications ranked by effectiveness (rank 1 is most effective), "
+    "each with brand name, medication type (pill/tablet, powder, liquid/gel, capsule, or cream/ointment/lotion) "
+    "and side effects. Respond only with JSON matching the given schema."
+)
+
+# Transient upstream statuses worth retrying
+RETRY_STATUS_CODES = {502, 503, 504}
+
+# Upper bound on a whole streamed completion, retries included; the client's read
+# timeout only limits the gap between chunks
+COMPLETION_DEADLINE_SECONDS = float(os.getenv("PERPLEXITY_DEADLINE_SECONDS", "45"))
+
+# Recommendations for the same inputs are cached for a day
+CACHE_TTL_SECONDS = 86400
+
+# Per-worker in-memory tier in front of Redis
+L1_CACHE_SIZE = 1024
+L1_CACHE_TTL_SECONDS = 600
+
+# Rendered results pages are cached for an hour
+PAGE_CACHE_TTL_SECONDS = 3600
+
+# JSON schema Perplexity must follow so responses parse with a single loads call
+MEDICATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "schema": {
+            "type": "object",
+            "required": ["medications"],
+            "properties": {
+                "medications": {
+                    "type": "array",
+                    "minItems": 3,
+                    "maxItems": 3,
+                    "items": {
+                        "type": "object",
+                        "required": ["rank", "name", "medication_type", "side_effects"],
+                        "properties": {
+                            "rank": {"type": "integer"},
+                            "name": {"type": "string"},
+                            "medication_type": {"type": "string"},
+                            "side_effects": {"type": "string"}
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+# Line scanner vocabulary for free-text responses
+_SECTION_PREFIXES = ("1.", "2.", "3.", "1)", "2)", "3)", "1st", "2nd", "3rd", "choice")
+_FIELD_KEYS = {
+    "name": "name",
+    "brand name": "name",
+    "medication": "name",
+    "type": "medication_type",
+    "type of medication": "medication_type",
+    "medication type": "medication_type",
+    "form": "medication_type",
+    "side effects": "side_effects",
+    "adverse effects": "side_effects",
+    "warnings": "side_effects",
+    "may cause": "side_effects",
+    "can cause": "side_effects"
+}
+_MEDICATION_TYPES = ("pill", "tablet", "liquid", "gel", "capsule", "cream", "ointment", "lotion", "powder")
+_DECORATION = "-*•# "
+_NUMBERED_ITEM = re.compile(r'(\d+)[.)]\s*')
+
+# Patterns used to build pharmacy search terms
+_PARENTHETICAL = re.compile(r'\([^)]*\)')
+_STRENGTH_DESIGNATION = re.compile(r'(?:extra strength|maximum strength|children\'s|infant\'s)', re.IGNORECASE)
+
+def _strip_code_fence(text: str) -> str:
+    """Remove a surrounding ``` or ```json fence that some replies wrap their JSON in."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text
+
+def _is_usable_name(name: Optional[str]) -> bool:
+    """A medication name must contain text and can't be leftover JSON or fence syntax."""
+    return bool(name) and name[0] not in "`{[" and any(c.isalnum() for c in name)
+
+def _append_field(section: Dict[str, Any], field: str, item: str):
+    """Add a list item to a section field, replacing an empty or placeholder value."""
+    item = item.strip()
+    if not item:
+        return
+    if section[field] in (None, "", "Not available"):
+        section[field] = item
+    elif field != "name":
+        section[field] = f"{section[field]}, {item}"
+
+def _canonical(value: str) -> str:
+    """Casefold and trim a value, collapsing inner whitespace runs to one space."""
+    return " ".join(value.split()).casefold()
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Retry connection-level failures and transient gateway errors only."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+def create_perplexity_client() -> httpx.AsyncClient:
+    """Create an HTTP/2 client so concurrent queries multiplex over one connection per worker."""
+    return httpx.AsyncClient(
+        base_url=PERPLEXITY_API_URL,
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+        timeout=httpx.Timeout(connect=3.0, read=30.0, write=10.0, pool=5.0)
+    )
+
 class PerplexityService:
     def __init__(self):
         self.api_key = os.getenv("PERPLEXITY_API_KEY")
-        self.api_url = "https://api.perplexity.ai"
-        
-        if not self.api_key:
-            logger.warning("Perplexity API key not found in environment variables")
-    
-    def query_perplexity(self, query: str) -> Optional[str]:
-        """Send a query to the Perplexity API using requests."""
-        headers = {
+        self.api_url = PERPLEXITY_API_URL
+        self._headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # Provided in startup() so the pool is bound to the running event loop
+        self._client: Optional[httpx.AsyncClient] = None
+        self._owns_client = False
+        self.redis_url = os.getenv("REDIS_URL")
+        self._redis: Optional[aioredis.Redis] = None
+        self._l1: cachetools.TTLCache = cachetools.TTLCache(maxsize=L1_CACHE_SIZE, ttl=L1_CACHE_TTL_SECONDS)
+        self._page_l1: cachetools.TTLCache = cachetools.TTLCache(maxsize=L1_CACHE_SIZE, ttl=L1_CACHE_TTL_SECONDS)
+        # In-flight fetches keyed by cache key, shared by identical concurrent requests
+        self._pending: Dict[str, asyncio.Task] = {}
         
+        if not self.api_key:
+            logger.warning("Perplexity API key not found in environment variables")
+
+    async def startup(self, client: Optional[httpx.AsyncClient] = None):
+        """Attach the worker's shared Perplexity client, opening a private one if none is given."""
+        self._owns_client = client is None
+        self._client = client or create_perplexity_client()
+        if self.redis_url:
+            self._redis = aioredis.Redis.from_url(self.redis_url)
+
+    async def shutdown(self):
+        """Cancel in-flight fetches and close the shared connection pool."""
+        for task in self._pending.values():
+            task.cancel()
+        self._pending.clear()
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+        self._client = None
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    def cache_key(self, symptoms: List[str], gender: str, age: str, allergic: str) -> str:
+        """Build a cache key that is identical for equivalent inputs."""
+        canonical = sorted({c for c in (_canonical(s) for s in symptoms) if c})
+        # Serialize as a JSON array so no separator inside a value can make two inputs collide
+        digest = hashlib.blake2b(
+            orjson.dumps((canonical, _canonical(gender), _canonical(age), _canonical(allergic))),
+            digest_size=16
+        ).hexdigest()
+        return f"med:{digest}"
+
+    def page_cache_key(self, symptoms: List[str], gender: str, age: str, allergic: str) -> str:
+        """Build a cache key for a rendered results page from the exact values it displays."""
+        digest = hashlib.blake2b(
+            "\0".join((", ".join(symptoms), gender, age, allergic)).encode(),
+            digest_size=16
+        ).hexdigest()
+        return f"html:{digest}"
+
+    async def _redis_get(self, key: str) -> Optional[bytes]:
+        """Read a raw value from Redis, or None when disabled, missing or failing."""
+        if self._redis is None:
+            return None
+        try:
+            return await self._redis.get(key)
+        except Exception as e:
+            logger.warning("Redis get failed: %s", e)
+            return None
+
+    async def _redis_set(self, key: str, value: bytes, ttl: int):
+        """Write a raw value to Redis; cache failures never fail the request."""
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(key, value, ex=ttl)
+        except Exception as e:
+            logger.warning("Redis set failed: %s", e)
+
+    async def _cache_get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Return cached recommendations from memory or Redis, or None on a miss or cache failure."""
+        medications = self._l1.get(key)
+        if medications is not None:
+            CACHE_HITS.labels(tier="l1").inc()
+            return medications
+        cached = await self._redis_get(key)
+        if not cached:
+            CACHE_MISSES.inc()
+            return None
+        CACHE_HITS.labels(tier="redis").inc()
+        medications = orjson.loads(cached)
+        self._l1[key] = medications
+        return medications
+
+    async def _cache_set(self, key: str, medications: List[Dict[str, Any]]):
+        """Store recommendations in memory and Redis."""
+        self._l1[key] = medications
+        await self._redis_set(key, orjson.dumps(medications, option=orjson.OPT_SORT_KEYS), CACHE_TTL_SECONDS)
+
+    async def get_cached_page(self, key: str) -> Optional[bytes]:
+        """Return a cached rendered results page from memory or Redis."""
+        page = self._page_l1.get(key)
+        if page is not None:
+            PAGE_CACHE_HITS.labels(tier="l1").inc()
+            return page
+        page = await self._redis_get(key)
+        if not page:
+            PAGE_CACHE_MISSES.inc()
+            return None
+        PAGE_CACHE_HITS.labels(tier="redis").inc()
+        self._page_l1[key] = page
+        return page
+
+    async def cache_page(self, key: str, page: bytes):
+        """Store a rendered results page in memory and Redis."""
+        self._page_l1[key] = page
+        await self._redis_set(key, page, PAGE_CACHE_TTL_SECONDS)
+    
+    async def query_perplexity(self, query: str, response_format: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Send a query to the Perplexity API and collect the streamed answer."""
+        try:
+            with PERPLEXITY_SECONDS.time():
+                return await asyncio.wait_for(
+                    self._collect_completion(query, response_format),
+                    timeout=COMPLETION_DEADLINE_SECONDS
+                )
+        except asyncio.TimeoutError:
+            logger.error("Perplexity query exceeded %ss deadline", COMPLETION_DEADLINE_SECONDS)
+            return None
+        except Exception as e:
+            logger.error("Error querying Perplexity API: %s", e)
+            return None
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential_jitter(initial=0.1, max=1.0),
+        retry=retry_if_exception(_is_retryable),
+        reraise=True
+    )
+    async def _collect_completion(self, query: str, response_format: Optional[Dict[str, Any]]) -> str:
+        """Collect one streamed answer, restarting the stream on transient failures."""
+        chunks = []
+        async for delta in self.stream_perplexity(query, response_format):
+            chunks.append(delta)
+        return "".join(chunks)
+
+    async def stream_perplexity(self, query: str, response_format: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Yield answer text from the Perplexity API as server-sent events arrive."""
         payload = {
             "model": "sonar-pro",
             "messages": [
@@ -32,133 +306,219 @@ class PerplexityService:
                     "role": "user",
                     "content": query
                 }
-            ]
+            ],
+            "stream": True
         }
-        
-        try:
-            response = requests.post(
-                f"{self.api_url}/chat/completions", 
-                headers=headers, 
-                json=payload
-            )
+        if response_format:
+            payload["response_format"] = response_format
+
+        if self._client is None:
+            raise RuntimeError("PerplexityService.startup() must be called before querying")
+
+        async with self._client.stream(
+            "POST",
+            "/chat/completions",
+            content=orjson.dumps(payload),
+            headers=self._headers
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                logger.error("Response status: %s", response.status_code)
+                logger.error("Response text: %s", response.text)
             response.raise_for_status()
-            
-            # Extract the response text
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
-        except Exception as e:
-            logger.error(f"Error querying Perplexity API: {e}")
 
-            if 'response' in locals():
-                logger.error(f"Response status: {response.status_code}")
-                logger.error(f"Response text: {response.text}")
-            return None
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[6:]
+                if data == "[DONE]":
+                    break
+                delta = orjson.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
     
-    def get_medication_recommendations(self, symptoms: List[str], gender: str, age: str, allergic: str) -> Optional[List[Dict[str, Any]]]:
+    async def get_medication_recommendations(self, symptoms: List[str], gender: str, age: str, allergic: str) -> Optional[List[Dict[str, Any]]]:
         """Get medication recommendations based on symptoms, gender, age and allergies."""
-        symptoms_text = ", ".join(symptoms)
-        
-        query = (
-            f"I'm {gender} and {age} years old. "
-            f"I'm allergic to {allergic}. "
-            f"I have the following symptoms: {symptoms_text}. "
-            f"Please recommend exactly 3 over-the-counter medications "
-            f"that would help, ranked by effectiveness (1st, 2nd, and 3rd choice). "
-            f"For each medication, provide: 1) Brand name, 2) Type of Medication ex) pill/tablet, Power, liquid/gel, Capsules, Creams/ointments/lotions 3) Side effects "
-            f"Format as a list with these details for each medication. "
-            f"Give list of medication without introduction ex) Here is list of medication or Based on the information provided"
+        key = self.cache_key(symptoms, gender, age, allergic)
+        cached = await self._cache_get(key)
+        if cached:
+            return cached
+
+        # Identical queries already waiting on Perplexity share one upstream call;
+        # shield it so one caller disconnecting doesn't cancel it for the others
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        if self._client is None:
+            raise RuntimeError("PerplexityService.startup() must be called before requesting recommendations")
+
+        task = asyncio.create_task(self._fetch_recommendations(key, symptoms, gender, age, allergic))
+        self._pending[key] = task
+        task.add_done_callback(partial(self._forget_pending, key))
+        return await asyncio.shield(task)
+
+    def _forget_pending(self, key: str, task: asyncio.Task):
+        """Drop a finished fetch so the next miss for its key starts a new one."""
+        if self._pending.get(key) is task:
+            del self._pending[key]
+
+    async def _fetch_recommendations(self, key: str, symptoms: List[str], gender: str, age: str, allergic: str) -> Optional[List[Dict[str, Any]]]:
+        """Query Perplexity for one set of inputs and cache the parsed result."""
+        query = _PROMPT.format(
+            gender=gender,
+            age=age,
+            allergic=allergic,
+            symptoms=", ".join(symptoms)
         )
         
-        response_text = self.query_perplexity(query)
+        response_text = await self.query_perplexity(query, MEDICATION_RESPONSE_FORMAT)
         if not response_text:
             return None
         
-        return self.parse_medication_recommendations(response_text)
+        with PARSE_SECONDS.time():
+            medications = self.parse_medication_recommendations(response_text)
+        if medications:
+            await self._cache_set(key, medications)
+        return medications
     
     def parse_medication_recommendations(self, response_text: str) -> List[Dict[str, Any]]:
-        """Extract medication recommendations from Perplexity response."""
-        medications = []
+        """Extract medication recommendations from a structured JSON Perplexity response."""
         try:
-            # Split recommendations by rank or numbered items
-            medication_sections = re.split(r'(?:\n\s*\n|\n\s*(?:\d+(?:st|nd|rd|th)\s*choice|choice\s*\d+:|^\d+\.))', response_text)
-            medication_sections = [s for s in medication_sections if s.strip()]
-            rank = 1
-
-            for section in medication_sections[:3]:  # Process max 3 items
-                if not section.strip():
+            items = orjson.loads(_strip_code_fence(response_text))["medications"]
+            medications = []
+            for item in items[:3]:
+                name = (item.get("name") or "").strip()
+                if not name:
                     continue
-
                 medication_info = {
-                    "rank": rank,
-                    "name": None,
-                    "medication_type": None,
-                    "side_effects": "Not available",
+                    "rank": len(medications) + 1,
+                    "name": name,
+                    "medication_type": item.get("medication_type") or None,
+                    "side_effects": item.get("side_effects") or "Not available",
                 }
+                medication_info.update(self.create_pharmacy_links(name))
+                medications.append(medication_info)
+            return medications
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning("Perplexity response was not valid JSON, falling back to text parsing: %s", e)
+            return self.parse_text_recommendations(response_text)
 
-                # Extract medication name
-                name_patterns = [
-                    r'(?:brand name|medication|name):\s*([^\n]+)',
-                    r'^(?:\d+\.\s*)?([^:\n]+)(?::|$)'
-                ]
-
-                for pattern in name_patterns:
-                    name_match = re.search(pattern, section, re.IGNORECASE | re.MULTILINE)
-                    if name_match:
-                        medication_info["name"] = name_match.group(1).strip()
-                        break
-
-                # Extract medication type
-                type_patterns = [
-                    r'(?:type of medication|form):\s*([^\n]+)',
-                    r'(?:pill|tablet|liquid|gel|capsule|cream|ointment|lotion|powder)s?'
-                ]
-
-                for pattern in type_patterns:
-                    type_match = re.search(pattern, section, re.IGNORECASE)
-                    if type_match:
-                        if len(type_match.groups()) > 0:
-                            medication_info["medication_type"] = type_match.group(1).strip()
-                        else:
-                            medication_info["medication_type"] = type_match.group(0).strip()
-                        break
-
-                # Extract side effects - More resilient approach
-                side_effects_patterns = [
-                    r'side effects:\s*([^\n]+(?:\n\s+[^\n]+)*)',  # Original pattern
-                    r'side effects[^:]*?(?:include|are|:)\s*([^\n]+(?:\n\s+[^\n]+)*)',  # More general
-                    r'(?:adverse effects|warnings):\s*([^\n]+(?:\n\s+[^\n]+)*)',  # Alternate terms
-                    r'(?:may cause|can cause):\s*([^\n]+(?:\n\s+[^\n]+)*)'  # potential start of the phrase
-                ]
-
-                for pattern in side_effects_patterns:
-                    side_effects_match = re.search(pattern, section, re.IGNORECASE)
-                    if side_effects_match:
-                        try:
-                            # Remove Photo reference from side effects if present
-                            side_effects_text = side_effects_match.group(1).strip()
-                            medication_info["side_effects"] = side_effects_text
-                            break  # Exit loop if a match is found
-                        except IndexError as e:
-                            logger.error(f"IndexError accessing regex group: {e}, pattern: {pattern}, section: {section}")
-
-                if medication_info["name"]:
-                    pharmacy_links = self.create_pharmacy_links(medication_info["name"])
-                    medication_info.update(pharmacy_links)
-                    medications.append(medication_info)
-                    rank += 1
+    def parse_text_recommendations(self, response_text: str) -> List[Dict[str, Any]]:
+        """Extract medication recommendations from a free-text Perplexity response in one pass over its lines."""
+        sections: List[Dict[str, Any]] = []
+        current: Optional[Dict[str, Any]] = None
+        after_blank = False
+        # Field whose value wraps onto the following indented lines
+        last_field: Optional[str] = None
+        # Field whose label had no value, collecting the list items below it
+        list_field: Optional[str] = None
+        list_numbered: Optional[bool] = None
+        # Indentation of the first numbered/ranked section line; deeper ones are sub-items
+        section_indent: Optional[int] = None
 
-            return medications
-        except Exception as e:
-            logger.exception(f"Error parsing medication recommendations: {e}, response_text: {response_text}")  # Log full exception + response
-            return []
+        for raw_line in response_text.splitlines():
+            line = raw_line.replace("**", "").strip().lstrip(_DECORATION)
+            if line.startswith("```"):
+                line = ""
+            if not line:
+                after_blank = True
+                last_field = None
+                list_field = None
+                continue
+            lowered = line.lower()
+            indent = len(raw_line) - len(raw_line.lstrip())
+
+            key, sep, value = line.partition(":")
+            field = _FIELD_KEYS.get(key.strip().lower()) if sep else None
+
+            # Items under a bare "Side effects:"-style label belong to that field; a list
+            # numbered from 1 keeps its numbers, a bulleted one ends at the next numbered line
+            if list_field and field is None:
+                number = _NUMBERED_ITEM.match(line)
+                if number:
+                    is_item = list_numbered if list_numbered is not None else number.group(1) == "1"
+                else:
+                    is_item = not lowered.startswith(_SECTION_PREFIXES)
+                if is_item:
+                    if list_numbered is None:
+                        list_numbered = bool(number)
+                    _append_field(current, list_field, line[number.end():] if number else line)
+                    continue
+            list_field = None
+
+            is_boundary = lowered.startswith(_SECTION_PREFIXES) and section_indent in (None, indent)
+
+            # An indented plain-text line continues the field assigned on the line before it
+            if (
+                last_field
+                and field is None
+                and raw_line[:1] in " \t"
+                and raw_line.lstrip()[:1] not in _DECORATION
+                and not is_boundary
+            ):
+                current[last_field] = f"{current[last_field]} {line}"
+                continue
+            last_field = None
+
+            # A numbered/ranked line, or a new unlabeled block after a blank line, starts a section
+            if is_boundary or current is None or (after_blank and field is None):
+                if current is not None and current["name"]:
+                    sections.append(current)
+                current = {"name": None, "medication_type": None, "side_effects": "Not available"}
+                if is_boundary:
+                    section_indent = indent
+                    if lowered.startswith(("1st", "2nd", "3rd")):
+                        line = line[3:]
+                    line = line.lstrip("0123456789.) ")
+                    if line.lower().startswith("choice"):
+                        line = line[6:]
+                    line = line.lstrip("0123456789.): ").rstrip()
+                    key, sep, value = line.partition(":")
+                    field = _FIELD_KEYS.get(key.strip().lower()) if sep else None
+                    lowered = line.lower()
+            after_blank = False
+
+            if not line:
+                continue
+            if field:
+                if not value.strip():
+                    list_field, list_numbered = field, None
+                elif field != "name" or not current["name"]:
+                    current[field] = value.strip()
+                    last_field = field
+            elif lowered.startswith("side effects"):
+                side_effects = line[12:].lstrip(" :")
+                for lead in ("include ", "are "):
+                    if side_effects.lower().startswith(lead):
+                        side_effects = side_effects[len(lead):]
+                if side_effects.strip():
+                    current["side_effects"] = side_effects.strip()
+                    last_field = "side_effects"
+                else:
+                    list_field, list_numbered = "side_effects", None
+            elif not current["name"]:
+                current["name"] = key.strip() if sep else line
+            elif not current["medication_type"] and any(word in lowered for word in _MEDICATION_TYPES):
+                current["medication_type"] = line
+
+        if current is not None and current["name"]:
+            sections.append(current)
+
+        medications = []
+        for section in [section for section in sections if _is_usable_name(section["name"])][:3]:
+            medication_info = {"rank": len(medications) + 1, **section}
+            medication_info.update(self.create_pharmacy_links(section["name"]))
+            medications.append(medication_info)
+        return medications
         
     def create_pharmacy_links(self, medication_name):
         """Create pharmacy links for a medication"""
         # Clean up the medication name for search
-        search_term = re.sub(r'\([^)]*\)', '', medication_name).strip()
+        search_term = _PARENTHETICAL.sub('', medication_name).strip()
         # Remove brand designations like "Extra Strength"
-        search_term = re.sub(r'(?:extra strength|maximum strength|children\'s|infant\'s)', '', search_term, flags=re.IGNORECASE).strip()
-        encoded_search = requests.utils.quote(search_term)
+        search_term = _STRENGTH_DESIGNATION.sub('', search_term).strip()
+        encoded_search = quote(search_term)
         
         return {
             "cvs_link": f"https://www.cvs.com/search?searchTerm={encoded_search}",
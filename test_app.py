@@ -0,0 +1,22 @@
+import io
+import logging
+
+import app
+
+def test_queued_log_lines_are_formatted_once():
+    stream = io.StringIO()
+    app.stream_handler.setStream(stream)
+    app.log_listener.start()
+    try:
+        logging.getLogger("app").info("Searching pharmacies for zipcode: %s", "94000")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("perplexity_service").exception("Error parsing medication recommendations")
+    finally:
+        app.log_listener.stop()
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == "INFO:app:Searching pharmacies for zipcode: 94000"
+    assert lines[1] == "ERROR:perplexity_service:Error parsing medication recommendations"
+    assert lines[-1] == "ValueError: boom"
@@ -0,0 +1,216 @@
+import asyncio
+
+from perplexity_service import PerplexityService
+
+def make_service(fetch):
+    """Service with Redis disabled and the upstream fetch replaced by a fake"""
+    service = PerplexityService()
+    service.redis_url = None
+    service._fetch_recommendations = fetch
+    return service
+
+def test_overlapping_distinct_requests_run_concurrently():
+    async def scenario():
+        async def slow_fetch(key, symptoms, gender, age, allergic):
+            await asyncio.sleep(0.3)
+            return [{"rank": 1, "name": symptoms[0]}]
+
+        service = make_service(slow_fetch)
+        await service.startup(client=object())
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def request_at(delay, symptom):
+            await asyncio.sleep(delay)
+            await service.get_medication_recommendations([symptom], "female", "30", "none")
+            return loop.time() - start
+
+        finished = await asyncio.gather(request_at(0, "cough"), request_at(0.1, "fever"), request_at(0.2, "rash"))
+        await service.shutdown()
+        return finished
+
+    finished = asyncio.run(scenario())
+    # Serialized batches would finish the last request at ~0.9s
+    assert max(finished) < 0.6
+
+def test_identical_concurrent_requests_share_one_fetch():
+    calls = []
+
+    async def scenario():
+        async def fetch(key, symptoms, gender, age, allergic):
+            calls.append(key)
+            await asyncio.sleep(0.1)
+            return [{"rank": 1, "name": "Advil"}]
+
+        service = make_service(fetch)
+        await service.startup(client=object())
+        results = await asyncio.gather(*(
+            service.get_medication_recommendations(["headache"], "male", "40", "none")
+            for _ in range(5)
+        ))
+        await service.shutdown()
+        return results
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(result == [{"rank": 1, "name": "Advil"}] for result in results)
+
+def summarize(medications):
+    return [(m["rank"], m["name"], m["medication_type"], m["side_effects"]) for m in medications]
+
+def test_parse_numbered_sections():
+    text = (
+        "1. Tylenol Extra Strength (Acetaminophen)\n"
+        "Type of Medication: tablet\n"
+        "Side effects: nausea, rash\n"
+        "\n"
+        "2. Advil\n"
+        "Form: capsule\n"
+        "Side effects: upset stomach\n"
+        "\n"
+        "3. Robitussin\n"
+        "liquid\n"
+        "May cause: drowsiness"
+    )
+    assert summarize(PerplexityService().parse_text_recommendations(text)) == [
+        (1, "Tylenol Extra Strength (Acetaminophen)", "tablet", "nausea, rash"),
+        (2, "Advil", "capsule", "upset stomach"),
+        (3, "Robitussin", "liquid", "drowsiness"),
+    ]
+
+def test_parse_ranked_choice_sections():
+    text = (
+        "1st choice: Aleve\n"
+        "Type: tablet\n"
+        "Side effects include headache\n"
+        "2nd Choice: Pepto-Bismol\n"
+        "Form: liquid\n"
+        "Choice 3: Tums"
+    )
+    assert summarize(PerplexityService().parse_text_recommendations(text)) == [
+        (1, "Aleve", "tablet", "headache"),
+        (2, "Pepto-Bismol", "liquid", "Not available"),
+        (3, "Tums", None, "Not available"),
+    ]
+
+def test_parse_markdown_bullets():
+    text = (
+        "1. **Brand name:** Zyrtec\n"
+        "   - **Type of Medication:** Tablet\n"
+        "   - **Side effects:** Drowsiness\n"
+        "\n"
+        "2. **Brand name:** Claritin\n"
+        "   - **Type of Medication:** Tablet\n"
+        "   - **Side effects:** Headache"
+    )
+    assert summarize(PerplexityService().parse_text_recommendations(text)) == [
+        (1, "Zyrtec", "Tablet", "Drowsiness"),
+        (2, "Claritin", "Tablet", "Headache"),
+    ]
+
+def test_parse_wrapped_side_effects():
+    text = (
+        "1. Tylenol\n"
+        "Side effects: nausea,\n"
+        "  rash, and in rare cases\n"
+        "  liver damage\n"
+        "2. Advil\n"
+        "Side effects: upset stomach"
+    )
+    assert summarize(PerplexityService().parse_text_recommendations(text)) == [
+        (1, "Tylenol", None, "nausea, rash, and in rare cases liver damage"),
+        (2, "Advil", None, "upset stomach"),
+    ]
+
+def test_query_gives_up_at_overall_deadline(monkeypatch):
+    import perplexity_service
+
+    monkeypatch.setattr(perplexity_service, "COMPLETION_DEADLINE_SECONDS", 0.1)
+    service = PerplexityService()
+
+    async def trickling_completion(query, response_format):
+        await asyncio.sleep(5)
+        return "never"
+
+    service._collect_completion = trickling_completion
+    assert asyncio.run(service.query_perplexity("query")) is None
+
+def test_cache_key_normalizes_equivalent_inputs():
+    service = PerplexityService()
+    assert service.cache_key(["Sore  Throat", "fever", "fever"], "Male", " 30 ", "none") == \
+        service.cache_key(["fever", "sore throat"], "male", "30", "None")
+
+def test_cache_key_separates_distinct_inputs():
+    service = PerplexityService()
+    assert service.cache_key(["a|b"], "male", "30", "none") != service.cache_key(["a", "b"], "male", "30", "none")
+    assert service.cache_key(["a#b"], "male", "30", "none") != service.cache_key(["a"], "b", "30", "none")
+    assert service.cache_key(["sore throat"], "male", "30", "none") != service.cache_key(["sorethroat"], "male", "30", "none")
+
+def test_parse_code_fenced_json():
+    text = (
+        "```json\n"
+        '{"medications": [{"rank": 1, "name": "Advil", "medication_type": "tablet", "side_effects": "nausea"}]}\n'
+        "```"
+    )
+    assert summarize(PerplexityService().parse_medication_recommendations(text)) == [
+        (1, "Advil", "tablet", "nausea"),
+    ]
+
+def test_unparseable_reply_yields_nothing_to_cache():
+    text = '```json\n{"medications": [{"rank": 1, "name": "Adv\n```'
+    assert PerplexityService().parse_medication_recommendations(text) == []
+
+def test_query_before_startup_fails_without_starting_service():
+    service = PerplexityService()
+    assert asyncio.run(service.query_perplexity("query")) is None
+    assert service._client is None
+
+def test_parse_numbered_sub_lists():
+    text = (
+        "1. Tylenol\n"
+        "Type: tablet\n"
+        "Side effects:\n"
+        "1. nausea\n"
+        "2. rash\n"
+        "\n"
+        "2. Advil\n"
+        "Uses:\n"
+        "   1. headache\n"
+        "   2. fever\n"
+        "Side effects: upset stomach\n"
+        "3. Aleve"
+    )
+    assert summarize(PerplexityService().parse_text_recommendations(text)) == [
+        (1, "Tylenol", "tablet", "nausea, rash"),
+        (2, "Advil", None, "upset stomach"),
+        (3, "Aleve", None, "Not available"),
+    ]
+
+def test_parse_side_effects_heading_with_bullets():
+    text = (
+        "1. Tylenol\n"
+        "Side effects:\n"
+        "- nausea\n"
+        "- rash\n"
+        "2. Advil\n"
+        "Side effects:\n"
+        "\n"
+        "3. Aleve\n"
+        "Side effects: drowsiness"
+    )
+    assert summarize(PerplexityService().parse_text_recommendations(text)) == [
+        (1, "Tylenol", None, "nausea, rash"),
+        (2, "Advil", None, "Not available"),
+        (3, "Aleve", None, "drowsiness"),
+    ]
+
+def test_recommendations_before_startup_fail_fast():
+    service = PerplexityService()
+    service.redis_url = None
+    try:
+        asyncio.run(service.get_medication_recommendations(["cough"], "female", "30", "none"))
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("expected RuntimeError")
+    assert service._pending == {}